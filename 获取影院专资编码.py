@@ -1,14 +1,29 @@
-import requests
+import httpx
+import asyncio
 import random
 import time
-import json
+import collections
+import itertools
+import functools
+import os
+import glob
+import multiprocessing
+import signal
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from tqdm import tqdm
-from queue import Queue
-from threading import Thread, Lock
 import logging
 from fake_useragent import UserAgent
 
+try:
+    import uvloop  # 基于 libuv 的事件循环，Windows 下没有，缺失时退回默认循环
+except ImportError:
+    uvloop = None
+
+run_loop = uvloop.run if uvloop else asyncio.run
+
 # 配置日志记录
 logging.basicConfig(
     level=logging.INFO,
@@ -18,241 +33,596 @@ logging.basicConfig(
         logging.StreamHandler()
     ]
 )
+# httpx/httpcore 每个请求都打一条 INFO，会刷屏并冲掉进度条，只保留警告以上
+logging.getLogger('httpx').setLevel(logging.WARNING)
+logging.getLogger('httpcore').setLevel(logging.WARNING)
+
+API_URL = 'https://ys.endata.cn/enlib-api/api/cinema/getcinema_baseinfo_byid.do'
+
+# 影院记录的列式结构（字段顺序与接口返回的 table0 一致）
+CINEMA_SCHEMA = pa.schema([
+    ('Company', pa.string()),
+    ('Address', pa.string()),
+    ('OnLineTime', pa.string()),
+    ('SeatCount_IMAX', pa.int32()),
+    ('EnCinemaName', pa.string()),
+    ('MapZB', pa.string()),
+    ('ProvinceName', pa.string()),
+    ('AreaName', pa.string()),
+    ('CityLevelName', pa.string()),
+    ('SeatCount_4D', pa.int32()),
+    ('ScreenCount_4D', pa.int32()),
+    ('HallCount', pa.int32()),
+    ('EnBaseID', pa.int32()),
+    ('CinemaName', pa.string()),
+    ('ScreenCount_DA', pa.int32()),
+    ('CinemaLineID', pa.int32()),
+    ('ScreenCount_DMAX', pa.int32()),
+    ('ScreenCount_DC', pa.int32()),
+    ('SeatCount_DC', pa.int32()),
+    ('SeatCount_DA', pa.int32()),
+    ('SeatCount_DMAX', pa.int32()),
+    ('AreaID', pa.int32()),
+    ('TelPhone', pa.string()),
+    ('ScreenCount', pa.int32()),
+    ('CityName', pa.string()),
+    ('CinemaLineName', pa.string()),
+    ('ZZID', pa.string()),
+    ('ProvinceID', pa.int32()),
+    ('SeatCount', pa.int32()),
+    ('CityID', pa.int32()),
+    ('ScreenCount_IMAX', pa.int32()),
+    ('HallName', pa.string()),
+    ('CinemaID', pa.int32()),
+    ('EnCinemaLineID', pa.int32()),
+    ('Extra', pa.string()),  # 结构里没有的字段、或类型对不上的值，以 JSON 保存，最终保存时再展开
+])
+CINEMA_FIELDS = frozenset(CINEMA_SCHEMA.names) - {'Extra'}
+
+def read_record_stream(path):
+    """读出 Arrow IPC 流文件里的全部完整批次；文件被截断时保留截断前的部分"""
+    batches = []
+    try:
+        reader = pa.ipc.open_stream(path)
+        while True:
+            batches.append(reader.read_next_batch())
+    except StopIteration:
+        pass
+    except (pa.ArrowException, OSError) as e:
+        logging.error(f"Stream {path} is truncated, kept {len(batches)} batches: {str(e)}")
+    return pa.Table.from_batches(batches, schema=CINEMA_SCHEMA)
+
+class TokenBucket:
+    """令牌桶限速器：每秒补充 rate 个令牌，桶里最多存 rate * burst 个
+
+    调整速率时保留桶里现有的令牌（超出新容量的部分丢弃），不会因为换速率而凭空多出一次突发。
+    """
+    def __init__(self, rate, burst=1.0):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = rate * burst
+        self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.rate * self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def set_rate(self, rate):
+        """修改速率，先按旧速率结算到当前时刻"""
+        self._refill()
+        self.rate = rate
+        self._tokens = min(self._tokens, rate * self.burst)
+
+    async def acquire(self):
+        """取一个令牌，桶空时按当前速率等待"""
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
 
 class SmartController:
     """智能速率控制器"""
-    def __init__(self):
-        self.last_success_time = time.time()
-        self.request_interval = 0.3  # 初始请求间隔
+    recover_interval = 10.0  # 距上次调速至少这么久没有出错，才把速率上调一档
+    slowdown_interval = 1.0  # 同一波限流响应只减速一次
+
+    def __init__(self, max_rate=20):
+        self.max_rate = max_rate  # 速率上限（请求/秒）
+        self.rate = max_rate  # 当前速率
+        self.limiter = TokenBucket(self.rate)  # 只在超出速率时才阻塞
+        self.rate_changed_at = time.monotonic()  # 最近一次调速或被限流的时刻
+        self.slowed_at = 0.0  # 最近一次减速的时刻
+        self.pause_until = 0.0  # 错误过多时全局暂停到该时刻（monotonic）
         self.timeout_count = 0
         self.error_count = 0
-        self.lock = Lock()
         self.ua = UserAgent()
-        
-    def get_headers(self):
-        """动态生成请求头"""
-        return {
-            'User-Agent': self.ua.random,
+        # 预先采样一批 UA，避免每次请求都走 fake_useragent 的随机查找
+        self._uas = [self.ua.random for _ in range(64)]
+        # 固定请求头，创建会话时一次性传入
+        self.base_headers = {
             'Accept': 'application/json, text/plain, */*',
             'Accept-Language': 'zh-CN,zh;q=0.9',
             'Content-Type': 'application/x-www-form-urlencoded',
             'Origin': 'https://ys.endata.cn',
             'Referer': 'https://ys.endata.cn/Details/Cinema',
         }
-    
-    def adjust_speed(self, success):
-        """根据请求结果动态调整速度"""
-        with self.lock:
-            now = time.time()
-            if success:
-                self.timeout_count = max(0, self.timeout_count - 1)
-                self.error_count = max(0, self.error_count - 0.5)
-                
-                # 如果连续成功，适当加快速度
-                if now - self.last_success_time < 0.5:
-                    self.request_interval = max(0.05, self.request_interval * 0.9)
-            else:
-                self.timeout_count += 1
-                self.error_count += 1
-                
-                # 根据错误频率动态调整
-                if self.timeout_count > 2:
-                    self.request_interval = min(5.0, self.request_interval * 1.5)
-                
-                # 如果错误太多，暂停一会儿
-                if self.error_count > 10:
-                    wait_time = min(60, 5 * self.error_count)
-                    logging.warning(f"Too many errors, sleeping for {wait_time} seconds")
-                    time.sleep(wait_time)
-                    self.error_count = 0
-            
-            self.last_success_time = now
-            return self.request_interval
+
+    def get_headers(self):
+        """动态生成请求头（仅轮换 User-Agent）"""
+        return {'User-Agent': self._uas[random.getrandbits(6)]}
+
+    def _set_rate(self, rate):
+        """更新令牌桶速率"""
+        if rate != self.rate:
+            self.rate = rate
+            self.limiter.set_rate(rate)
+
+    def _slow_down(self, factor):
+        """减速，同一波错误在 slowdown_interval 内只减一次"""
+        now = time.monotonic()
+        self.rate_changed_at = now  # 推迟恢复
+        if now - self.slowed_at >= self.slowdown_interval:
+            self.slowed_at = now
+            self._set_rate(max(1, self.rate / factor))
+
+    async def acquire(self):
+        """等待全局暂停结束，再从令牌桶取一个令牌"""
+        delay = self.pause_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self.limiter.acquire()
+
+    def adjust_speed(self, success, throttled=False):
+        """根据请求结果动态调整速度；throttled 表示服务器返回了 429/5xx
+
+        只在事件循环线程里调用且内部没有 await，状态更新天然不会交错，无需加锁。
+        """
+        if success:
+            self.timeout_count = max(0, self.timeout_count - 1)
+            self.error_count = max(0, self.error_count - 0.5)
+
+            # 一段时间内没有再被限流，才逐档恢复速率
+            now = time.monotonic()
+            if self.rate < self.max_rate and now - self.rate_changed_at >= self.recover_interval:
+                self.rate_changed_at = now
+                self._set_rate(min(self.max_rate, self.rate * 1.25))
+        else:
+            self.timeout_count += 1
+            self.error_count += 1
+
+            # 服务器限流时速率减半，连续超时则适当降速
+            if throttled:
+                self._slow_down(2)
+            elif self.timeout_count > 2:
+                self._slow_down(1.5)
+
+            # 如果错误太多，所有请求暂停一会儿
+            if self.error_count > 10:
+                wait_time = min(60, 5 * self.error_count)
+                logging.warning(f"Too many errors, sleeping for {wait_time} seconds")
+                self.pause_until = time.monotonic() + wait_time
+                self.error_count = 0
+
+class RecordStream:
+    """把影院记录按批写入 Arrow IPC 流文件，内存里只保留一个批次的 dict"""
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.count = 0
+        self._buffer = []
+        self._file = open(path, 'wb')
+        self._writer = pa.ipc.new_stream(self._file, CINEMA_SCHEMA)
+
+    def append(self, record):
+        """追加一条记录，攒够一批后写出"""
+        extra = record.keys() - CINEMA_FIELDS
+        if extra:
+            # 接口新增的字段不丢弃，放进 Extra
+            record = dict(record, Extra=orjson.dumps({k: record[k] for k in extra}).decode())
+        self._buffer.append(record)
+        self.count += 1
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def _coerce(self, record):
+        """把类型对不上的值挪进 Extra（字符串列直接转成字符串），并记录日志"""
+        fixed = dict(record)
+        extra = orjson.loads(record['Extra']) if record.get('Extra') else {}
+        for field in CINEMA_SCHEMA:
+            value = record.get(field.name)
+            if value is None or field.name == 'Extra':
+                continue
+            try:
+                pa.scalar(value, field.type)
+            except pa.ArrowException:
+                if field.type == pa.string():
+                    fixed[field.name] = str(value)
+                else:
+                    fixed[field.name] = None
+                    extra[field.name] = value
+                logging.warning(f"Cinema {record.get('CinemaID')}: {field.name}={value!r} does not fit {field.type}")
+        if extra:
+            fixed['Extra'] = orjson.dumps(extra).decode()
+        return fixed
+
+    def flush(self):
+        """把缓冲区写成一个 RecordBatch 并落盘；写不进去的记录另存到 .rejected.jsonl，不会中断抓取"""
+        if self._buffer:
+            try:
+                try:
+                    batch = pa.RecordBatch.from_pylist(self._buffer, schema=CINEMA_SCHEMA)
+                except pa.ArrowException:
+                    batch = pa.RecordBatch.from_pylist([self._coerce(r) for r in self._buffer], schema=CINEMA_SCHEMA)
+                self._writer.write_batch(batch)
+            except Exception as e:
+                logging.error(f"Failed to write {len(self._buffer)} records, saving them to {self.path}.rejected.jsonl: {str(e)}")
+                with open(f'{self.path}.rejected.jsonl', 'ab') as f:
+                    for record in self._buffer:
+                        f.write(orjson.dumps(record, default=str) + b'\n')
+            self._buffer.clear()
+        self._file.flush()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            try:
+                self._writer.close()
+            finally:
+                self._file.close()
+
+    def read_table(self):
+        """读出目前已落盘的全部记录"""
+        return read_record_stream(self.path)
 
 class CinemaScraper:
-    def __init__(self):
-        self.controller = SmartController()
-        self.session = requests.Session()
-        self.session.mount('https://', requests.adapters.HTTPAdapter(
-            max_retries=3,
-            pool_connections=10,
-            pool_maxsize=20
-        ))
-        self.print_lock = Lock()
-        self.data_lock = Lock()
-        
-    def get_cinema_data(self, cinemaid, retry=3):
+    def __init__(self, max_rate=20):
+        self.controller = SmartController(max_rate)
+        self.session = None  # 在 run 中于事件循环内创建
+        self._fetch = None  # 绑定好会话的请求函数，见 _make_fetch
+        self._counter = itertools.count()  # r 参数只是防缓存用的随机数，递增计数即可
+        self.status_counts = collections.Counter()  # 非 200 响应的状态码统计
+        self.part = None  # 多进程分片时的分片编号
+        self._stopping = False  # 父进程要求本分片提前结束
+
+    def _make_fetch(self):
+        """生成绑定了会话、URL、请求头和计数器的请求函数，热路径上不再反复查找属性"""
+        def fetch(cinemaid,
+                  _post=functools.partial(self.session.post, API_URL),
+                  _headers=self.controller.get_headers,
+                  _next=self._counter.__next__):
+            # 直接发送编码好的表单体，Content-Type 已在会话请求头中
+            return _post(headers=_headers(), content=f'r=0.{_next()}&cinemaid={cinemaid}'.encode())
+        return fetch
+
+    async def get_cinema_data(self, cinemaid, retry=3):
         """获取单个影院数据"""
         for attempt in range(retry):
             try:
-                # 动态等待
-                wait_time = self.controller.adjust_speed(True)
-                time.sleep(wait_time)
-                
-                response = self.session.post(
-                    'https://ys.endata.cn/enlib-api/api/cinema/getcinema_baseinfo_byid.do',
-                    headers=self.controller.get_headers(),
-                    data={
-                        'r': str(random.random()),
-                        'cinemaid': str(cinemaid)
-                    },
-                    timeout=(3.05, 30)
+                # 令牌桶限速，只在超出速率时等待
+                await self.controller.acquire()
+                response = await self._fetch(cinemaid)
+
+                # 先检查状态码，成功路径上不构造任何异常对象
+                status = response.status_code
+                if status != 200:
+                    # 非 200 不能当成“没有这家影院”：403/401/408 多半是被反爬拦截，
+                    # 交给下面的降速重试逻辑，最终失败会记入错误日志
+                    self.status_counts[status] += 1
+                    raise httpx.HTTPStatusError(
+                        f"Unexpected status {status} for cinema ID {cinemaid}",
+                        request=response.request, response=response
+                    )
+
+                json_data = orjson.loads(response.content)
+                self.controller.adjust_speed(True)
+
+                if json_data.get('status') != 1:
+                    return None
+                # status==1 但没有 data/table0 也是正常的“无数据”，不能抛 KeyError
+                table0 = (json_data.get('data') or {}).get('table0')
+                return table0[0] if table0 else None
+
+            except httpx.HTTPError as e:
+                throttled = isinstance(e, httpx.HTTPStatusError) and (
+                    e.response.status_code == 429 or e.response.status_code >= 500
                 )
-                
-                response.raise_for_status()
-                json_data = response.json()
-                
-                if json_data.get('status') == 1 and json_data.get('data', {}).get('table0'):
-                    return json_data['data']['table0'][0]
-                
-                return None
-                
-            except requests.exceptions.RequestException as e:
-                self.controller.adjust_speed(False)
+                self.controller.adjust_speed(False, throttled)
                 if attempt == retry - 1:
                     logging.warning(f"Failed cinema ID {cinemaid}: {str(e)}")
                     raise
-                
+
                 # 指数退避等待
                 wait_time = (2 ** attempt) + random.random()
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
             except Exception as e:
                 self.controller.adjust_speed(False)
                 logging.error(f"Unexpected error with ID {cinemaid}: {str(e)}")
                 return None
-    
-    def worker(self, queue, results, errors, pbar):
-        """工作线程函数"""
-        while True:
+
+    async def worker(self, cinemaid, semaphore):
+        """单个影院的抓取协程，由信号量限制并发数，返回 (cinemaid, 数据, 错误)"""
+        async with semaphore:
             try:
-                cinemaid = queue.get_nowait()
-                
+                return cinemaid, await self.get_cinema_data(cinemaid), None
+
+            except Exception as e:
+                return cinemaid, None, {
+                    'cinemaid': cinemaid,
+                    'error': str(e),
+                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+                }
+
+    async def _probe(self, start_id, end_id, semaphore, bucket_size=500, stride=100):
+        """粗粒度抽样 ID 空间，返回有数据的分桶内的全部 ID"""
+        probes = [
+            self.worker(cinemaid, semaphore)
+            for cinemaid in range(start_id, end_id + 1, stride)
+        ]
+        populated = set()
+        for cinemaid, data, error in await asyncio.gather(*probes):
+            # 抽样出错时保守地认为该分桶有数据
+            if data or error:
+                populated.add((cinemaid - start_id) // bucket_size)
+
+        logging.info(f"Probe found {len(populated)} populated buckets of {bucket_size} IDs")
+        return list(itertools.chain.from_iterable(
+            range(start_id + b * bucket_size, min(start_id + (b + 1) * bucket_size, end_id + 1))
+            for b in sorted(populated)
+        ))
+
+    async def _watch_stop(self, stop, task):
+        """父进程置位 stop 后，取消正在运行的 run，让它正常收尾"""
+        while not stop.is_set():
+            await asyncio.sleep(0.5)
+        self._stopping = True
+        task.cancel()
+
+    async def run(self, start_id=1, end_id=50000, max_concurrency=100, probe=True,
+                  part=None, timestamp=None, stop=None):
+        """运行爬虫；probe=True 时先抽样跳过没有数据的 ID 区间
+
+        part 不为空时作为多进程的一个分片运行：记录写到 cinemas_{timestamp}_part{part}.arrow，
+        结束时不生成最终文件，由 run_sharded 合并后统一保存。stop 是父进程传来的
+        multiprocessing.Event，置位后本分片写完已有数据并提前返回。返回错误记录列表。
+        """
+        self.part = part
+        watcher = asyncio.create_task(self._watch_stop(stop, asyncio.current_task())) if stop else None
+        timestamp = timestamp or time.strftime("%Y%m%d_%H%M%S")
+        suffix = f'_part{part}' if part is not None else ''
+        # 成功的记录只由下面的 as_completed 循环单点写入，无需加锁
+        errors = collections.deque()
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        # HTTP/2 在同一个 TLS 连接上多路复用请求；服务器不支持时自动回退到 HTTP/1.1 keep-alive
+        self.session = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=50),
+            headers=self.controller.base_headers,
+            timeout=httpx.Timeout(30.0, connect=3.0)
+        )
+        self._fetch = self._make_fetch()
+
+        # 探测阶段也在保护范围内：中途 Ctrl-C 或分片被叫停时同样关闭会话、取消 watcher
+        try:
+            if probe:
+                cinemaids = await self._probe(start_id, end_id, semaphore)
+            else:
+                cinemaids = range(start_id, end_id + 1)
+
+            records = RecordStream(f'results/cinemas_{timestamp}{suffix}.arrow')
+
+            # 每小时自动保存一次进度（parquet 检查点）
+            saver = asyncio.create_task(self._periodic_save(3600, records, errors))
+
+            # 初始化进度条
+            with tqdm(total=len(cinemaids), desc="Scraping Progress", mininterval=0.5,
+                      position=part or 0) as pbar:
                 try:
-                    data = self.get_cinema_data(cinemaid)
-                    if data:
-                        with self.data_lock:
-                            results.append(data)
-                    
-                    with self.print_lock:
-                        pbar.set_description(f"Last ID: {cinemaid}, Found: {len(results)}")
+                    tasks = [
+                        self.worker(cinemaid, semaphore)
+                        for cinemaid in cinemaids
+                    ]
+                    for finished in asyncio.as_completed(tasks):
+                        cinemaid, data, error = await finished
+                        if data:
+                            records.append(data)
+                        if error:
+                            errors.append(error)
+
                         pbar.update(1)
-                        
-                except Exception as e:
-                    with self.data_lock:
-                        errors.append({
-                            'cinemaid': cinemaid,
-                            'error': str(e),
-                            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
-                        })
-                
+                        # 每 128 条才更新一次描述，避免频繁重绘终端
+                        if pbar.n & 127 == 0:
+                            pbar.set_description(f"Last ID: {cinemaid}, Found: {records.count}")
+
+                except asyncio.CancelledError:
+                    if not self._stopping:
+                        logging.info("Received keyboard interrupt, stopping tasks...")
+                        raise
+                    logging.info(f"Shard{suffix} asked to stop, saving what it has...")
+
                 finally:
-                    queue.task_done()
-                    
-            except Exception as e:
-                break
-    
-    def run(self, start_id=1, end_id=50000, max_threads=5):
-        """运行爬虫"""
-        all_cinemas = []
+                    saver.cancel()
+                    try:
+                        records.close()
+                    finally:
+                        # 最终文件保存成功后删除原始流文件，与 run_sharded 删除分片文件的做法一致
+                        if part is None and self.save_results(records.read_table(), errors):
+                            os.remove(records.path)
+                    logging.info(f"Scraping{suffix} completed. Found {records.count} cinemas, {len(errors)} errors.")
+                    if self.status_counts:
+                        logging.info(f"Non-200 responses by status: {dict(self.status_counts)}")
+
+        finally:
+            if watcher:
+                watcher.cancel()
+            await self.session.aclose()
+
+        return list(errors)
+
+    def run_sharded(self, start_id=1, end_id=50000, processes=4, max_rate=20, **options):
+        """把 ID 区间切成 processes 段，每段在独立进程的事件循环里抓取，最后合并保存"""
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        size = -(-(end_id - start_id + 1) // processes)
+        shards = [
+            (part, shard_start, min(shard_start + size - 1, end_id), timestamp, max_rate / processes, options)
+            for part, shard_start in enumerate(range(start_id, end_id + 1, size))
+        ]
+
         errors = []
-        task_queue = Queue()
-        
-        # 填充任务队列
-        for cinemaid in range(start_id, end_id + 1):
-            task_queue.put(cinemaid)
-        
-        # 初始化进度条
-        with tqdm(total=end_id - start_id + 1, desc="Scraping Progress") as pbar:
-            # 启动工作线程
-            threads = []
-            for _ in range(max_threads):
-                t = Thread(
-                    target=self.worker,
-                    args=(task_queue, all_cinemas, errors, pbar),
-                    daemon=True
-                )
-                t.start()
-                threads.append(t)
-            
-            # 监控线程状态
+        # 子进程忽略 SIGINT，Ctrl-C 只由父进程处理：通过 stop 通知各分片写完数据后正常返回
+        stop = multiprocessing.Event()
+        pool = multiprocessing.Pool(len(shards), initializer=_init_shard_worker, initargs=(stop,))
+        try:
+            pending = pool.map_async(scrape_range, shards)
             try:
-                while any(t.is_alive() for t in threads):
-                    time.sleep(1)
-                    # 每小时自动保存一次进度
-                    if int(time.time()) % 3600 == 0:
-                        self.save_results(all_cinemas, errors)
-                
-                task_queue.join()
-                
+                part_results = pending.get()
             except KeyboardInterrupt:
-                logging.info("Received keyboard interrupt, stopping threads...")
-                while not task_queue.empty():
-                    task_queue.get()
-                    task_queue.task_done()
-                
-                for t in threads:
-                    if t.is_alive():
-                        t.join(timeout=1)
-            
-            finally:
-                self.save_results(all_cinemas, errors)
-                logging.info(f"Scraping completed. Found {len(all_cinemas)} cinemas, {len(errors)} errors.")
-    
-    def save_results(self, all_cinemas, errors):
+                logging.info("Received keyboard interrupt, waiting for shards to save their data...")
+                stop.set()
+                part_results = pending.get()
+            for part_errors in part_results:
+                errors.extend(part_errors)
+            pool.close()
+
+        except BaseException:
+            # 再次 Ctrl-C 等情况才强制结束子进程
+            pool.terminate()
+            raise
+
+        finally:
+            pool.join()
+            paths = sorted(glob.glob(f'results/cinemas_{timestamp}_part*.arrow'))
+            tables = [read_record_stream(path) for path in paths]
+            table = pa.concat_tables(tables) if tables else CINEMA_SCHEMA.empty_table()
+            if self.save_results(table, errors):
+                for path in paths:
+                    os.remove(path)
+            logging.info(f"Sharded scraping completed. Found {table.num_rows} cinemas, {len(errors)} errors.")
+
+    async def _periodic_save(self, interval, records, errors):
+        """按单调时钟的截止时间定期保存检查点"""
+        next_save = time.monotonic() + interval
+        while True:
+            await asyncio.sleep(max(0, next_save - time.monotonic()))
+            records.flush()
+            self.save_checkpoint(records, errors)
+            next_save += interval
+
+    def save_checkpoint(self, records, errors):
+        """保存进度检查点（parquet，比 xlsx 快得多）"""
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        if self.part is not None:
+            timestamp += f'_part{self.part}'
+        errors = list(errors)
+
+        try:
+            table = records.read_table()
+            if table.num_rows:
+                pq.write_table(table, f'results/all_cinemas_data_{timestamp}.parquet')
+
+            if errors:
+                pd.DataFrame(errors).to_parquet(f'results/error_logs_{timestamp}.parquet', index=False)
+
+            logging.info(f"Checkpoint saved at {timestamp}")
+
+        except Exception as e:
+            logging.error(f"Failed to save checkpoint: {str(e)}")
+
+    def _to_excel(self, df, path):
+        """用 xlsxwriter 写出 xlsx
+
+        不能开 constant_memory：pandas 按列写单元格，而该模式下离开一行后再写入会被静默丢弃。
+        """
+        with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False)
+
+    def save_results(self, table, errors):
         """保存结果到文件"""
         timestamp = time.strftime("%Y%m%d_%H%M%S")
-        
+        errors = list(errors)
+
         try:
             # 保存完整数据
-            if all_cinemas:
-                df_full = pd.DataFrame(all_cinemas)
-                df_full.to_excel(f'results/all_cinemas_data_{timestamp}.xlsx', index=False)
+            if table.num_rows:
+                # 记录按完成顺序（以及分片顺序）到达，统一按 CinemaID 排序后再输出
+                table = table.sort_by('CinemaID')
+                # 只从这一份列式数据出发：完整表转一次 pandas，简略数据按列投影
+                pq.write_table(table, f'results/all_cinemas_data_{timestamp}.parquet')
+                df_full = table.to_pandas()
+                # 把 Extra 里的新字段和类型不符的原始值展开回普通列
+                extra = df_full.pop('Extra').dropna().map(orjson.loads)
+                if len(extra):
+                    extra = pd.DataFrame(extra.tolist(), index=extra.index)
+                    for col in extra.columns:
+                        df_full[col] = extra[col].combine_first(df_full[col]) if col in df_full else extra[col]
+                self._to_excel(df_full, f'results/all_cinemas_data_{timestamp}.xlsx')
                 df_full.to_json(f'results/all_cinemas_data_{timestamp}.json', orient='records', force_ascii=False)
-                
+
                 # 保存简略数据
-                df_simple = pd.DataFrame([{
-                    'CinemaID': x.get('CinemaID'),
-                    'CinemaName': x.get('CinemaName'),
-                    'ZZID': x.get('ZZID'),
-                    'Province': x.get('ProvinceName'),
-                    'City': x.get('CityName')
-                } for x in all_cinemas])
-                df_simple.to_excel(f'results/cinema_name_zzid_{timestamp}.xlsx', index=False)
-
-                simple_data = [{
-                                "CinemaName": x.get("CinemaName"),
-                                "ZZID": x.get("ZZID"),
-                                "CinemaID": x.get("CinemaID")
-                            } for x in all_cinemas]
-                            
-                with open(f'results/cinema_simple_{timestamp}.json', 'w', encoding='utf-8') as f:
-                    json.dump(simple_data, f, ensure_ascii=False, indent=2)
-            
+                df_simple = df_full[['CinemaID', 'CinemaName', 'ZZID', 'ProvinceName', 'CityName']].rename(
+                    columns={'ProvinceName': 'Province', 'CityName': 'City'}
+                )
+                self._to_excel(df_simple, f'results/cinema_name_zzid_{timestamp}.xlsx')
+
+                simple_data = table.select(['CinemaName', 'ZZID', 'CinemaID']).to_pylist()
+                with open(f'results/cinema_simple_{timestamp}.json', 'wb') as f:
+                    f.write(orjson.dumps(simple_data, option=orjson.OPT_INDENT_2))
+
             # 保存错误日志
             if errors:
                 df_errors = pd.DataFrame(errors)
-                df_errors.to_excel(f'results/error_logs_{timestamp}.xlsx', index=False)
-            
+                self._to_excel(df_errors, f'results/error_logs_{timestamp}.xlsx')
+
             logging.info(f"Results saved at {timestamp}")
-        
+            return True
+
         except Exception as e:
             logging.error(f"Failed to save results: {str(e)}")
+            return False
+
+_stop_event = None  # 子进程里由 _init_shard_worker 设置
+
+def _init_shard_worker(stop):
+    """子进程初始化：忽略 Ctrl-C，改由父进程通过 stop 事件通知结束"""
+    global _stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _stop_event = stop
+
+def scrape_range(shard):
+    """子进程入口：抓取一个分片的 ID 区间，返回该分片的错误记录"""
+    part, start_id, end_id, timestamp, max_rate, options = shard
+    scraper = CinemaScraper(max_rate=max_rate)
+    try:
+        return run_loop(scraper.run(start_id, end_id, part=part, timestamp=timestamp,
+                                    stop=_stop_event, **options))
+    except asyncio.CancelledError:
+        # 还在抽样阶段就被要求结束，此时尚未写出任何记录
+        return []
 
 if __name__ == '__main__':
-    import os
     os.makedirs('results', exist_ok=True)
-    
-    scraper = CinemaScraper()
-    
+
+    max_rate = 20    # 每秒最多请求数（多进程时所有进程合计）
+    processes = 4    # 进程数，1 表示单进程运行
+
+    scraper = CinemaScraper(max_rate=max_rate)
+
     # 配置参数
     config = {
         'start_id': 1,         # 起始ID
         'end_id': 50000,       # 结束ID (预估范围)
-        'max_threads': 5       # 并发线程数
+        'max_concurrency': 100, # 最大并发请求数（每个进程）
+        'probe': True          # 先抽样探测有数据的ID区间
     }
-    
-    logging.info("Starting cinema scraper with config: %s", config)
-    scraper.run(**config)
-
-
 
+    logging.info("Starting cinema scraper with config: %s, processes: %s", config, processes)
+    if processes > 1:
+        scraper.run_sharded(processes=processes, max_rate=max_rate, **config)
+    else:
+        try:
+            run_loop(scraper.run(**config))
+        except KeyboardInterrupt:
+            pass